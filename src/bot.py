@@ -3,26 +3,46 @@ Discord bot for managing prompt battles between attackers and defenders.
 This bot handles prompt creation, battle execution, and leaderboard tracking.
 """
 
+import asyncio
+import hashlib
 import logging
 import logging.handlers
+import os
+from pathlib import Path
 from dotenv import load_dotenv
 import discord
+import orjson
 from discord import app_commands
 from discord.ext import commands
 from typing import Optional
 
 from managers import PromptManager, BattleManager
-from agent_utils.agent_utils import chat
+from agent_utils.agent_utils import close_client, stream_chat
 
 load_dotenv()
 
+class PayloadFormatter(logging.Formatter):
+    """
+    Log formatter that appends a record's structured payload as JSON.
+    
+    Handlers attach event data with logger.info("...", extra={"payload": {...}});
+    the payload is serialized with orjson only when the record is formatted.
+    Values orjson cannot encode natively (e.g. Discord users) are logged via str().
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        message = super().format(record)
+        payload = getattr(record, "payload", None)
+        if payload is not None:
+            message += " " + orjson.dumps(payload, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+        return message
+
 logger = logging.getLogger("promptoftroy")
 logger.setLevel(logging.INFO)
 
 console_handler = logging.StreamHandler()
 console_handler.setLevel(logging.INFO)
 
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+formatter = PayloadFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 console_handler.setFormatter(formatter)
 
 logger.addHandler(console_handler)
@@ -31,7 +51,22 @@ intents = discord.Intents.default()
 intents.members = True
 intents.message_content = True
 intents.reactions = True
-discord_client = commands.Bot(command_prefix='$',intents=intents)
+
+
+class PromptOfTroyBot(commands.Bot):
+    """Bot that also releases the shared Groq connections when it shuts down."""
+    async def close(self):
+        await super().close()
+        await close_client()
+
+
+discord_client = PromptOfTroyBot(command_prefix='$',intents=intents)
+
+# Fingerprint of the command tree as last synced to Discord
+COMMAND_HASH_PATH = Path("data/.cmd_hash")
+
+# Minimum seconds between edits of a streamed reply, to stay within Discord rate limits
+REPLY_EDIT_INTERVAL = 0.5
 
 def is_mentioned(interaction: discord.Interaction) -> bool:
     """
@@ -63,44 +98,85 @@ def require_mention():
         return True
     return app_commands.check(predicate)
 
+def command_tree_hash() -> str:
+    """
+    Compute a fingerprint of the locally defined application commands.
+    
+    Returns:
+        str: SHA-256 hex digest of the command payloads Discord would receive on sync
+    """
+    commands_payload = sorted(
+        (cmd.to_dict(discord_client.tree) for cmd in discord_client.tree.get_commands()),
+        key=lambda c: c["name"]
+    )
+    return hashlib.sha256(orjson.dumps(commands_payload, default=str, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+async def sync_command_tree():
+    """
+    Sync the command tree globally and record its fingerprint.
+    """
+    await discord_client.tree.sync(guild=None)
+    COMMAND_HASH_PATH.parent.mkdir(parents=True, exist_ok=True)
+    COMMAND_HASH_PATH.write_text(command_tree_hash())
+
 @discord_client.event
 async def on_ready():
     """
     Handles bot startup tasks:
     - Waits for client to be ready
-    - Syncs command tree globally
+    - Syncs command tree globally if commands changed since the last sync
     - Logs successful login
     """
     await discord_client.wait_until_ready()
     try:
-        await discord_client.tree.sync(guild=None)  
-        logger.info("Commands synced globally")
+        synced_hash = COMMAND_HASH_PATH.read_text().strip() if COMMAND_HASH_PATH.exists() else None
+        if synced_hash == command_tree_hash():
+            logger.info("Commands unchanged since last sync, skipping sync")
+        else:
+            await sync_command_tree()
+            logger.info("Commands synced globally")
     except Exception as e:
-        logger.error(f"Failed to sync commands: {e}", exc_info=True)
-    logger.info("Logged in", extra={"user": discord_client.user})
+        logger.error("Failed to sync commands: %s", e, exc_info=True)
+    logger.info("Logged in", extra={"payload": {"user": discord_client.user}})
 
 @discord_client.event
 async def on_message(message):
-    logger.info(
-        {"message": message.content, "author": message.author, "id": message.id}
-    )
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(
+            "Message received",
+            extra={"payload": {"message": message.content, "author": message.author, "id": message.id}},
+        )
     if message.author != discord_client.user:
         if isinstance(message.channel, discord.channel.DMChannel) or (discord_client.user and discord_client.user.mentioned_in(message)):
-            response = chat(message.content)
-            await message.reply(response)
+            # Stream the response into the reply, editing it as text arrives
+            reply = await message.reply("…")
+            loop = asyncio.get_running_loop()
+            response = shown = ""
+            last_edit = loop.time()
+            async for piece in stream_chat(message.content):
+                response += piece
+                if loop.time() - last_edit >= REPLY_EDIT_INTERVAL:
+                    await reply.edit(content=response)
+                    shown, last_edit = response, loop.time()
+            if response != shown:
+                await reply.edit(content=response)
     
 @discord_client.event
 async def on_reaction_add(reaction, user):
     message = reaction.message
-    logger.info(
-        {
-            "message": message.content,
-            "author": message.author,
-            "id": message.id,
-            "reaction": reaction.emoji,
-            "reactor": user,
-        }
-    )
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(
+            "Reaction added",
+            extra={
+                "payload": {
+                    "message": message.content,
+                    "author": message.author,
+                    "id": message.id,
+                    "reaction": reaction.emoji,
+                    "reactor": user,
+                }
+            },
+        )
     await message.reply("reaction")
 
 def help_msg():
@@ -112,8 +188,10 @@ Welcome to Prompt of Troy, a Discord bot to facilitate attack/defense prompt fig
 """
     return response
 
-prompt_manager = PromptManager(csv_path="data/prompts.csv")  # Manages prompt storage and retrieval
-battle_manager = BattleManager(prompt_manager)  # Handles battle execution and scoring
+# Set STORAGE_FORMAT=parquet to keep data files as Parquet (requires pyarrow) instead of CSV
+storage_ext = "parquet" if os.getenv("STORAGE_FORMAT", "csv").lower() == "parquet" else "csv"
+prompt_manager = PromptManager(csv_path=f"data/prompts.{storage_ext}")  # Manages prompt storage and retrieval
+battle_manager = BattleManager(prompt_manager, csv_path=f"data/battles.{storage_ext}")  # Handles battle execution and scoring
 
 @discord_client.tree.command(name="prompt", description="Manage prompts")
 @app_commands.describe(
@@ -218,37 +296,54 @@ async def battle(
             f"Use /execute {battle.battle_id} to start the battle."
         )
     except Exception as e:
-        logger.error(f"Failed to setup battle: {str(e)}", exc_info=True)
+        logger.error("Failed to setup battle: %s", e, exc_info=True)
         await interaction.response.send_message(f"Failed to setup battle: {str(e)}")
 
+def battle_result_msg(battle) -> str:
+    """
+    Format the outcome of a completed battle.
+    
+    Args:
+        battle: The completed Battle
+        
+    Returns:
+        str: Winner, attack outcome and rating changes
+    """
+    return (
+        f"Battle {battle.battle_id} completed!\n"
+        f"Winner: {battle.winner}\n"
+        f"Attack {'succeeded' if battle.result['attack_wins'] else 'failed'}\n"
+        f"Rating changes:\n"
+        f"- Red: {battle.result['rating_change'][battle.red_prompt]:.1f}\n"
+        f"- Blue: {battle.result['rating_change'][battle.blue_prompt]:.1f}\n"
+    )
+
 @discord_client.tree.command(name="execute", description="Execute a battle")
 @app_commands.describe(
-    battle_id="ID of the battle to execute"
+    battle_id="ID of the battle to execute (separate several IDs with spaces to run them together)"
 )
 async def execute(
     interaction: discord.Interaction, 
     battle_id: str
 ):
     """
-    Executes a prepared battle and displays results.
+    Executes one or more prepared battles and displays results.
+    Several battles are executed concurrently.
     
     Args:
         interaction: Discord interaction context
-        battle_id: ID of the battle to execute
+        battle_id: ID of the battle to execute, or several space-separated IDs
     """
     try:
-        battle = await battle_manager.execute_battle(battle_id)
-        response = (
-            f"Battle {battle.battle_id} completed!\n"
-            f"Winner: {battle.winner}\n"
-            f"Attack {'succeeded' if battle.result['attack_wins'] else 'failed'}\n"
-            f"Rating changes:\n"
-            f"- Red: {battle.result['rating_change'][battle.red_prompt]:.1f}\n"
-            f"- Blue: {battle.result['rating_change'][battle.blue_prompt]:.1f}\n"
-        )
+        battle_ids = battle_id.split()
+        if len(battle_ids) > 1:
+            battles = await battle_manager.execute_battles(battle_ids)
+        else:
+            battles = [await battle_manager.execute_battle(battle_id)]
+        response = "\n".join(battle_result_msg(b) for b in battles)
         await interaction.response.send_message(response)
     except Exception as e:
-        logger.error(f"Failed to execute battle: {str(e)}", exc_info=True)
+        logger.error("Failed to execute battle: %s", e, exc_info=True)
         await interaction.response.send_message(f"Failed to execute battle: {str(e)}")
 
 @discord_client.tree.command(name="status", description="Check battle status")
@@ -315,20 +410,11 @@ async def leaderboard(interaction: discord.Interaction, category: Optional[str]
         interaction: Discord interaction context
         category: Optional filter for 'attack' or 'defense' prompts only
     """
-    prompts = prompt_manager.list_prompts()
-    
-    if category == "attack":
-        prompts = [p for p in prompts if p.type == "attack"]
-    elif category == "defense":
-        prompts = [p for p in prompts if p.type == "defense"]
-        
     # 按照評分排序
-    sorted_prompts = sorted(prompts, key=lambda x: x.rating, reverse=True)
-    
-    response = "🏆 Leaderboard:\n"
-    for i, p in enumerate(sorted_prompts[:10], 1):
-        response += f"{i}. {p.id} - Rating: {p.rating} (W/L: {p.battles_won}/{p.battles_lost})\n"
-        
+    response = battle_manager.render_leaderboard(
+        "🏆 Leaderboard:",
+        category=category if category in ("attack", "defense") else None
+    )
     await interaction.response.send_message(response)
 
 @discord_client.tree.command(name="stats", description="View player statistics")
@@ -344,18 +430,18 @@ async def stats(interaction: discord.Interaction, player: Optional[str] = None):
         player: Optional player mention to view stats for. Shows own stats if omitted
     """
     user_id = player[1:] if player else str(interaction.user.id)
-    prompts = prompt_manager.list_prompts(user_id=user_id)
+    user_stats = prompt_manager.user_stats(user_id)
     
-    if not prompts:
+    if not user_stats:
         await interaction.response.send_message("No stats found for this player.")
         return
         
-    total_wins = sum(p.battles_won for p in prompts)
-    total_losses = sum(p.battles_lost for p in prompts)
-    avg_rating = sum(p.rating for p in prompts) / len(prompts)
+    total_wins = user_stats["wins"]
+    total_losses = user_stats["losses"]
+    avg_rating = user_stats["rating_sum"] / user_stats["prompts"]
     
     response = f"📊 Stats for @{user_id}:\n"
-    response += f"Total Prompts: {len(prompts)}\n"
+    response += f"Total Prompts: {user_stats['prompts']}\n"
     response += f"Total Battles: {total_wins + total_losses}\n"
     response += f"Win Rate: {(total_wins/(total_wins+total_losses)*100):.1f}%\n"
     response += f"Average Rating: {avg_rating:.0f}\n"
@@ -364,15 +450,10 @@ async def stats(interaction: discord.Interaction, player: Optional[str] = None):
 
 @discord_client.tree.command(name="battle_history", description="View battle history")
 async def battle_history(interaction: discord.Interaction, filter: Optional[str] = None):
-    battles = list(battle_manager.battles.values())
-    
-    if filter:
-        battles = [b for b in battles if filter in b.red_prompt or filter in b.blue_prompt]
-        
-    battles.sort(key=lambda x: x.time, reverse=True)
+    battles = battle_manager.recent_battles(filter)
     
     response = "⚔️ Recent Battles:\n"
-    for b in battles[:10]:
+    for b in battles:
         response += f"ID: {b.battle_id}\n"
         response += f"Red: {b.red_prompt} vs Blue: {b.blue_prompt}\n"
         response += f"Winner: {b.winner}\n"
@@ -403,19 +484,13 @@ async def create(
         )
         await interaction.response.send_message(f"Prompt created! ID: {prompt.id}")
     except Exception as e:
-        logger.error(f"Creation failed: {str(e)}", exc_info=True)
+        logger.error("Creation failed: %s", e, exc_info=True)
         await interaction.response.send_message(f"Creation failed: {str(e)}")
 
 @discord_client.tree.command(name="top", description="View top players")
 async def top(interaction: discord.Interaction):
     """View leaderboard"""
-    prompts = prompt_manager.list_prompts()
-    sorted_prompts = sorted(prompts, key=lambda x: x.rating, reverse=True)
-    
-    response = "🏆 Top Players:\n"
-    for i, p in enumerate(sorted_prompts[:10], 1):
-        response += f"{i}. {p.id} - Rating: {p.rating} (W/L: {p.battles_won}/{p.battles_lost})\n"
-        
+    response = battle_manager.render_leaderboard("🏆 Top Players:")
     await interaction.response.send_message(response)
 
 @discord_client.tree.command(name="sync", description="Sync commands (Admin only)")
@@ -424,8 +499,8 @@ async def sync(interaction: discord.Interaction):
     """Sync commands"""
     try:
         # 強制同步所有命令
-        await discord_client.tree.sync(guild=None)
+        await sync_command_tree()
         await interaction.response.send_message("Commands synced globally!")
     except Exception as e:
-        logger.error(f"Failed to sync commands: {e}", exc_info=True)
+        logger.error("Failed to sync commands: %s", e, exc_info=True)
         await interaction.response.send_message(f"Failed to sync commands: {e}")
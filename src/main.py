@@ -1,9 +1,12 @@
 # Import required logging modules for handling log files and configuration
+import asyncio
+import atexit
 import logging
 import logging.handlers
 import os
+import queue
 from dotenv import load_dotenv  # For loading environment variables
-from bot import discord_client  # Import the Discord bot client
+from bot import discord_client, PayloadFormatter  # Import the Discord bot client and log formatter
 
 def main():
     """
@@ -14,7 +17,9 @@ def main():
     1. Configures the root logger for the application
     2. Sets up rotating file handler for log management
     3. Formats log messages with timestamp and level
-    4. Starts the Discord bot with token from environment
+    4. Routes file logging through a background thread
+    5. Uses uvloop for the event loop when it is installed
+    6. Starts the Discord bot with token from environment
     """
     # Get the application logger
     logger = logging.getLogger("promptoftroy")
@@ -32,14 +37,29 @@ def main():
     
     # Configure timestamp format for log messages
     dt_fmt = "%Y-%m-%d %H:%M:%S"
-    # Set up log message format with timestamp, level, logger name
-    formatter = logging.Formatter(
+    # Set up log message format with timestamp, level, logger name and JSON payload
+    formatter = PayloadFormatter(
         "[{asctime}] [{levelname:<8}] {name}: {message}", dt_fmt, style="{"
     )
     
-    # Apply formatter to handler and add to logger
+    # Apply formatter to handler
     handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    
+    # Hand records to a queue so disk writes and rotation happen on the
+    # listener's thread instead of blocking the bot's event loop
+    log_queue = queue.Queue(-1)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    
+    # Prefer the libuv-based event loop where available (not supported on Windows)
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        logger.info("Using uvloop event loop")
+    except ImportError:
+        pass
     
     # Log session start and run Discord bot
     logger.info("Start session")
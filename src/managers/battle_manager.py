@@ -1,123 +1,177 @@
-import csv
+import ast
+import asyncio
+import heapq
+import itertools
+import json
+from collections import defaultdict, deque
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional, Dict, List
-from datetime import datetime
+from typing import Deque, Iterator, Optional, Dict, List, Tuple
 from models.battle import Battle
+from models.prompt import Prompt
 from .prompt_manager import PromptManager
+from . import storage
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
+# Expected ELO score of the lower-indexed side for rating differences of
+# -ELO_DIFF_LIMIT..ELO_DIFF_LIMIT; larger gaps are clipped to the limit
+ELO_DIFF_LIMIT = 2000
+_EXPECTED_SCORE = tuple(1 / (1 + 10**(diff / 400)) for diff in range(-ELO_DIFF_LIMIT, ELO_DIFF_LIMIT + 1))
+
 class BattleManager:
-    def __init__(self, prompt_manager: PromptManager):
+    COLUMNS = [
+        'battle_id', 'red_prompt', 'blue_prompt', 'status',
+        'time', 'winner', 'result', 'secret_key', 
+        'defense_prompt_with_key'
+    ]
+    # Seconds a rendered leaderboard may be served from cache
+    LEADERBOARD_TTL = 2.0
+    
+    def __init__(self, prompt_manager: PromptManager, csv_path: str = "data/battles.csv"):
         """Initialize the BattleManager
         
         Args:
             prompt_manager: PromptManager instance for handling prompts
+            csv_path: Path to the file for storing battles (default: "data/battles.csv").
+                A ".parquet" path stores battles as Parquet instead of CSV
             
         Side effects:
             - Creates data directory if it doesn't exist
-            - Initializes battles.csv if it doesn't exist
-            - Loads existing battles from CSV
+            - Initializes the battles file if it doesn't exist
+            - Loads existing battles from it
         """
         self.battles: Dict[str, Battle] = {}
+        # Battles in chronological order, overall and per participating prompt ID
+        self._history: Deque[Battle] = deque()
+        self._by_prompt: Dict[str, Deque[Battle]] = defaultdict(deque)
         self.prompt_manager = prompt_manager
-        self.csv_path = Path("data/battles.csv")
+        # (title, category, limit) -> (render time, prompt manager version, leaderboard text)
+        self._top_cache: Dict[Tuple[str, Optional[str], int], Tuple[float, int, str]] = {}
+        # Number used for the next "battle_N" ID; never reused, even if battles are removed
+        self._next_id = 0
+        self.csv_path = Path(csv_path)
         self.init_storage()
         self.load_battles()
     
     def init_storage(self):
-        """Initialize storage directory and CSV file
+        """Initialize storage directory and data file
         
         Creates the data directory if it doesn't exist and initializes
-        the CSV file with appropriate headers for battle data.
+        the data file with appropriate headers for battle data.
         
-        CSV columns:
+        Columns:
         - battle_id: Unique identifier for the battle
         - red_prompt: ID of the attacking prompt
         - blue_prompt: ID of the defending prompt
         - status: Current battle status (setup/completed)
         - time: Battle timestamp
         - winner: ID of the winning prompt
-        - result: Dictionary containing battle results
+        - result: Dictionary containing battle results (JSON)
         - secret_key: Secret key for the defense prompt
         - defense_prompt_with_key: Complete defense prompt with secret key
+        
+        A CSV file is an append-only log: a battle gets a new row whenever it
+        changes, and the last row for a battle_id wins when loading. A Parquet
+        file is rewritten on every change instead.
         """
-        self.csv_path.parent.mkdir(parents=True, exist_ok=True)
-        if not self.csv_path.exists():
-            with open(self.csv_path, 'w', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow([
-                    'battle_id', 'red_prompt', 'blue_prompt', 'status',
-                    'time', 'winner', 'result', 'secret_key', 
-                    'defense_prompt_with_key'
-                ])
+        storage.init_table(self.csv_path, self.COLUMNS)
     
     def load_battles(self):
-        """Load all battles from CSV file
+        """Load all battles from the data file
         
-        Reads the battles.csv file and creates Battle objects for each row.
-        Handles potential errors during loading and logs relevant information.
+        Reads the battles file and creates Battle objects for each row.
+        Later rows for the same battle_id replace earlier ones. If the log
+        contains superseded rows, it is compacted to one row per battle.
         
         Side effects:
-            - Populates self.battles dictionary
-            - Logs loading status and any errors
+            - Populates self.battles dictionary and the battle history
+            - Continues battle ID numbering after the highest stored ID
+            - Rewrites the battles file if it contained superseded rows
         """
         if not self.csv_path.exists():
             return
             
-        with open(self.csv_path, 'r', newline='') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                battle = Battle(
-                    battle_id=row['battle_id'],
-                    red_prompt=row['red_prompt'],
-                    blue_prompt=row['blue_prompt'],
-                    status=row['status'],
-                    time=datetime.fromisoformat(row['time']),
-                    winner=row['winner'],
-                    result=eval(row['result']) if row['result'] else None,
-                    secret_key=row['secret_key'],
-                    defense_prompt_with_key=row['defense_prompt_with_key']
-                )
-                self.battles[battle.battle_id] = battle
+        rows = storage.read_rows(self.csv_path)
+        for row in rows:
+            battle = Battle(
+                battle_id=row['battle_id'],
+                red_prompt=row['red_prompt'],
+                blue_prompt=row['blue_prompt'],
+                status=row['status'],
+                time=storage.parse_datetime(row['time']),
+                winner=row['winner'],
+                result=self._parse_result(row['result']),
+                secret_key=row['secret_key'],
+                defense_prompt_with_key=row['defense_prompt_with_key']
+            )
+            self.battles[battle.battle_id] = battle
+        
+        numbers = (battle_id.removeprefix("battle_") for battle_id in self.battles)
+        self._next_id = 1 + max((int(n) for n in numbers if n.isdigit()), default=-1)
+        
+        row_count = len(rows)
+        if row_count > len(self.battles):
+            logger.info("Compacting battle log from %d rows to %d", row_count, len(self.battles))
+            self.save_battles()
+        
+        for battle in sorted(self.battles.values(), key=lambda b: b.time):
+            self._record_history(battle)
+    
+    def _record_history(self, battle: Battle):
+        """Append a battle to the chronological history indexes"""
+        self._history.append(battle)
+        self._by_prompt[battle.red_prompt].append(battle)
+        self._by_prompt[battle.blue_prompt].append(battle)
     
     def save_battles(self):
-        """Save all battles to CSV file
+        """Save all battles to the data file
         
-        Writes the current state of all battles to the CSV file.
-        Includes error handling and maintains data consistency.
+        Rewrites the data file with one row per battle. Routine changes are
+        written with append_battle instead; this is used to compact the log.
         
         Side effects:
-            - Updates the battles.csv file with current battle data
+            - Updates the battles file with current battle data
             - Preserves battle history and results
         """
-        with open(self.csv_path, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                'battle_id', 'red_prompt', 'blue_prompt', 'status',
-                'time', 'winner', 'result', 'secret_key', 
-                'defense_prompt_with_key'
-            ])
-            for battle in self.battles.values():
-                writer.writerow([
-                    battle.battle_id,
-                    battle.red_prompt,
-                    battle.blue_prompt,
-                    battle.status,
-                    battle.time.isoformat(),
-                    battle.winner,
-                    str(battle.result) if battle.result else None,
-                    battle.secret_key,
-                    battle.defense_prompt_with_key
-                ])
+        storage.write_rows(self.csv_path, self.COLUMNS, [self._battle_row(b) for b in self.battles.values()])
+    
+    def append_battle(self, battle: Battle):
+        """Append a battle's current state to the data file
+        
+        For CSV this writes a single row, so the cost does not grow with the
+        number of stored battles; the row supersedes any earlier row for the
+        same battle. Parquet files cannot be appended to and are rewritten.
+        
+        Args:
+            battle: Battle to record
+        """
+        if not storage.append_row(self.csv_path, self._battle_row(battle)):
+            self.save_battles()
+    
+    @staticmethod
+    def _battle_row(battle: Battle) -> list:
+        """Build the CSV row for a battle"""
+        return [
+            battle.battle_id,
+            battle.red_prompt,
+            battle.blue_prompt,
+            battle.status,
+            battle.time,
+            battle.winner,
+            json.dumps(battle.result, default=str) if battle.result else None,
+            battle.secret_key,
+            battle.defense_prompt_with_key
+        ]
     
     def find_matching_opponents(self, prompt_id: str, num_opponents: int = 3) -> List[str]:
         """Find opponents with similar ELO ratings
         
         This function matches prompts based on their ELO ratings and ensures type compatibility
-        (attack vs defense). It sorts potential opponents by rating difference to find the
-        closest matches.
+        (attack vs defense). It selects the closest matches by rating difference with a
+        heap, so only the requested number of opponents are kept in order.
         
         Args:
             prompt_id: ID of the prompt seeking opponents
@@ -136,21 +190,21 @@ class BattleManager:
         # Get all potential opponents of the opposite type
         opponent_type = "defense" if prompt.type == "attack" else "attack"
         potential_opponents = [
-            p for p in self.prompt_manager.prompts.values()
-            if p.type == opponent_type and p.id != prompt_id
+            p for p in self.prompt_manager.list_prompts(type=opponent_type)
+            if p.id != prompt_id
         ]
         
         if not potential_opponents:
             raise ValueError(f"No {opponent_type} prompts available for battle")
             
-        # Sort opponents by ELO rating difference
-        sorted_opponents = sorted(
+        # Pick the N closest matches by ELO rating difference
+        target = prompt.rating
+        closest = heapq.nsmallest(
+            num_opponents,
             potential_opponents,
-            key=lambda x: abs(x.rating - prompt.rating)
+            key=lambda x: abs(x.rating - target)
         )
-        
-        # Return the N closest matches
-        return [p.id for p in sorted_opponents[:num_opponents]]
+        return [p.id for p in closest]
     
     async def start_battle(self, red_prompt_id: str, blue_prompt_id: str = None) -> Battle:
         """Initialize a new battle between two prompts
@@ -193,7 +247,8 @@ class BattleManager:
             red_prompt_id, blue_prompt_id = blue_prompt_id, red_prompt_id
             red_prompt, blue_prompt = blue_prompt, red_prompt
         
-        battle_id = f"battle_{len(self.battles)}"
+        battle_id = f"battle_{self._next_id}"
+        self._next_id += 1
         battle = Battle(
             battle_id=battle_id,
             red_prompt=red_prompt_id,
@@ -205,7 +260,8 @@ class BattleManager:
         battle.setup_defense(blue_prompt.content)
         
         self.battles[battle.battle_id] = battle
-        self.save_battles()
+        self._record_history(battle)
+        self.append_battle(battle)
         
         return battle
     
@@ -227,61 +283,175 @@ class BattleManager:
         Raises:
             ValueError: If battle not found or in invalid state
         """
-        logger.info(f"Attempting to execute battle: {battle_id}")
+        battle, red_prompt = self._prepare_battle(battle_id)
+        
+        with self._executing([(battle, red_prompt)]):
+            # Execution Phase: Run the attack
+            [(response, verdict)] = await self._run_attacks([(battle, red_prompt)])
+            
+            # Evaluation Phase: Check if attack succeeded
+            attack_wins = await battle.evaluate_battle(response, verdict)
+            
+            await self._finish_battle(battle, attack_wins)
+        return battle
+    
+    async def execute_battles(self, battle_ids: List[str]) -> List[Battle]:
+        """Execute several battles concurrently
+        
+        All battles are validated up front, then their attacks and evaluations
+        run concurrently so the LLM round trips overlap. Results and ELO ratings
+        are applied afterwards in the order the IDs were given, with the
+        prompt data saved once for the whole batch.
+        
+        Args:
+            battle_ids: Unique identifiers of the battles to execute
+            
+        Returns:
+            Updated Battle objects with results, in the same order as battle_ids
+            
+        Raises:
+            ValueError: If an ID is repeated, or any battle is not found or in invalid state
+        """
+        if len(set(battle_ids)) != len(battle_ids):
+            raise ValueError("Each battle can only be executed once")
+            
+        prepared = [self._prepare_battle(battle_id) for battle_id in battle_ids]
+        
+        with self._executing(prepared):
+            # Execution Phase: Run all attacks concurrently
+            outcomes = await self._run_attacks(prepared)
+            
+            # Evaluation Phase: Check all responses concurrently
+            results = await asyncio.gather(*(
+                battle.evaluate_battle(response, verdict)
+                for (battle, _), (response, verdict) in zip(prepared, outcomes)
+            ))
+            
+            battles = []
+            with self.prompt_manager.batch():
+                for (battle, _), attack_wins in zip(prepared, results):
+                    await self._finish_battle(battle, attack_wins)
+                    battles.append(battle)
+        return battles
+    
+    def _prepare_battle(self, battle_id: str) -> Tuple[Battle, Prompt]:
+        """Validate a battle before execution
+        
+        Args:
+            battle_id: Unique identifier of the battle to execute
+            
+        Returns:
+            Tuple of the Battle object and its attacking (red) Prompt
+            
+        Raises:
+            ValueError: If battle not found, in invalid state, or its prompts are missing
+        """
+        logger.debug("Attempting to execute battle: %s", battle_id)
         
         battle = self.battles.get(battle_id)
         if not battle:
-            logger.error(f"Battle not found: {battle_id}")
+            logger.error("Battle not found: %s", battle_id)
             raise ValueError(f"Invalid battle ID: {battle_id}")
             
         if battle.status != "setup":
-            logger.error(f"Invalid battle status: {battle.status}")
+            logger.error("Invalid battle status: %s", battle.status)
             raise ValueError(f"Battle {battle_id} not in setup phase, current status: {battle.status}")
         
         # Verify and retrieve prompts
-        logger.info(f"Looking for prompts - Red: {battle.red_prompt}, Blue: {battle.blue_prompt}")
-        logger.info(f"Available prompts: {list(self.prompt_manager.prompts.keys())}")
+        logger.debug("Looking for prompts - Red: %s, Blue: %s", battle.red_prompt, battle.blue_prompt)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Available prompts: %s", list(self.prompt_manager.prompts.keys()))
         
         red_prompt = self.prompt_manager.prompts.get(battle.red_prompt)
         blue_prompt = self.prompt_manager.prompts.get(battle.blue_prompt)
         
         if not red_prompt:
-            logger.error(f"Red prompt not found: {battle.red_prompt}")
+            logger.error("Red prompt not found: %s", battle.red_prompt)
             raise ValueError(f"Red prompt not found: {battle.red_prompt}")
             
         if not blue_prompt:
-            logger.error(f"Blue prompt not found: {battle.blue_prompt}")
+            logger.error("Blue prompt not found: %s", battle.blue_prompt)
             raise ValueError(f"Blue prompt not found: {battle.blue_prompt}")
             
-        logger.info("Found both prompts:")
-        logger.info(f"Red prompt: {red_prompt.id} - {red_prompt.content}")
-        logger.info(f"Defense prompt with key: {battle.defense_prompt_with_key}")
+        logger.debug("Found both prompts:")
+        logger.debug("Red prompt: %s - %s", red_prompt.id, red_prompt.content)
+        logger.debug("Defense prompt with key: %s", battle.defense_prompt_with_key)
         
-        # Execution Phase: Run the attack
-        from agent_utils.agent_utils import execute_battle_chat
-        response = execute_battle_chat(
-            attack_prompt=red_prompt.content,
-            defense_prompt=battle.defense_prompt_with_key
-        )
+        return battle, red_prompt
+    
+    @contextmanager
+    def _executing(self, prepared: List[Tuple[Battle, Prompt]]) -> Iterator[None]:
+        """Mark prepared battles as running for the duration of the block
+        
+        While a battle is in the "execution" state, _prepare_battle rejects it,
+        so a concurrent command cannot run the same battle twice. Battles that
+        have not completed when the block fails go back to "setup" so they can
+        be retried.
+        
+        Args:
+            prepared: (Battle, attacking Prompt) tuples from _prepare_battle
+        """
+        for battle, _ in prepared:
+            battle.status = "execution"
+        try:
+            yield
+        except BaseException:
+            for battle, _ in prepared:
+                if battle.status == "execution":
+                    battle.status = "setup"
+            raise
+    
+    async def _run_attacks(self, prepared: List[Tuple[Battle, Prompt]]) -> List[Tuple[str, Optional[bool]]]:
+        """Run the attacks of prepared battles concurrently
         
-        # Evaluation Phase: Check if attack succeeded
-        attack_wins = battle.evaluate_battle(response)
+        When fused judging is enabled (FUSED_BATTLE_JUDGE), each reply also
+        carries the model's own leak verdict, saving the separate evaluation call.
+        
+        Args:
+            prepared: (Battle, attacking Prompt) tuples from _prepare_battle
+            
+        Returns:
+            (response, verdict) tuples in the same order as prepared; verdict is
+            None unless a fused verdict was produced
+        """
+        from agent_utils.agent_utils import battle_and_judge_many, execute_battle_chat_many, fused_judge_enabled
+        if fused_judge_enabled():
+            return await battle_and_judge_many([
+                (red_prompt.content, battle.defense_prompt_with_key, battle.secret_key)
+                for battle, red_prompt in prepared
+            ])
+        responses = await execute_battle_chat_many([
+            (red_prompt.content, battle.defense_prompt_with_key)
+            for battle, red_prompt in prepared
+        ])
+        return [(response, None) for response in responses]
+    
+    async def _finish_battle(self, battle: Battle, attack_wins: bool):
+        """Record the outcome of an evaluated battle
         
-        # Update battle results
+        Args:
+            battle: Battle object that has been executed and evaluated
+            attack_wins: True if attacker won, False if defender won
+            
+        Side effects:
+            - Sets the battle winner and marks it completed
+            - Updates prompt statistics and ELO ratings
+            - Appends the completed battle to the battles file
+        """
         battle.winner = battle.red_prompt if attack_wins else battle.blue_prompt
         battle.status = "completed"
         
         # Update prompt statistics and ELO ratings
         await self._update_battle_results(battle, attack_wins)
         
-        self.save_battles()
-        return battle
+        self.append_battle(battle)
     
     async def _update_battle_results(self, battle: Battle, attack_wins: bool):
         """Update battle results and adjust ELO ratings
         
         Updates win/loss records and recalculates ELO ratings for both prompts.
-        Uses standard ELO formula with K-factor of 32 for rating adjustments.
+        Uses standard ELO formula with K-factor of 32 for rating adjustments, with
+        expected scores read from a table precomputed per whole-point rating gap.
         
         Args:
             battle: Battle object containing the match details
@@ -293,7 +463,7 @@ class BattleManager:
         Side effects:
             - Updates prompt win/loss records
             - Adjusts prompt ELO ratings
-            - Saves updated data to CSV files
+            - Saves updated prompt data
         """
         red_prompt = self.prompt_manager.prompts[battle.red_prompt]
         blue_prompt = self.prompt_manager.prompts[battle.blue_prompt]
@@ -308,16 +478,18 @@ class BattleManager:
         
         # Calculate ELO rating changes
         k_factor = 32  # Standard chess K-factor
-        red_expected = 1 / (1 + 10**((blue_prompt.rating - red_prompt.rating)/400))
+        diff = round(blue_prompt.rating - red_prompt.rating)
+        red_expected = _EXPECTED_SCORE[max(-ELO_DIFF_LIMIT, min(ELO_DIFF_LIMIT, diff)) + ELO_DIFF_LIMIT]
         red_actual = 1 if attack_wins else 0
         
         # Apply ELO adjustments
         red_prompt.rating += k_factor * (red_actual - red_expected)
         blue_prompt.rating += k_factor * ((1-red_actual) - (1-red_expected))
         
-        # Save updated prompt data
-        self.prompt_manager.update_prompt(red_prompt)
-        self.prompt_manager.update_prompt(blue_prompt)
+        # Save updated prompt data in a single write
+        with self.prompt_manager.batch():
+            self.prompt_manager.update_prompt(red_prompt)
+            self.prompt_manager.update_prompt(blue_prompt)
         
         # Record battle results
         battle.result = {
@@ -332,10 +504,78 @@ class BattleManager:
         battle.status = "completed"
         
         self.battles[battle.battle_id] = battle
-        self.save_battles()
         
         return battle
 
+    def render_leaderboard(self, title: str, category: Optional[str] = None, limit: int = 10) -> str:
+        """Render the top rated prompts as a leaderboard message
+        
+        Rendered text is cached for LEADERBOARD_TTL seconds and rebuilt early
+        if any prompt has been created, deleted or updated since, so bursts
+        of leaderboard requests reuse the same string.
+        
+        Args:
+            title: Heading line for the leaderboard
+            category: Optional filter for "attack" or "defense" prompts only
+            limit: Maximum number of prompts to list (default: 10)
+            
+        Returns:
+            Leaderboard text with one ranked line per prompt
+        """
+        key = (title, category, limit)
+        now = time.monotonic()
+        version = self.prompt_manager.version
+        cached = self._top_cache.get(key)
+        if cached and cached[1] == version and now - cached[0] < self.LEADERBOARD_TTL:
+            return cached[2]
+        
+        response = f"{title}\n"
+        for i, p in enumerate(self.prompt_manager.top_k(limit, type=category), 1):
+            response += f"{i}. {p.id} - Rating: {p.rating:.0f} (W/L: {p.battles_won}/{p.battles_lost})\n"
+        
+        self._top_cache[key] = (now, version, response)
+        return response
+    
+    def recent_battles(self, filter: Optional[str] = None, limit: int = 10) -> List[Battle]:
+        """Get the most recent battles, newest first
+        
+        A filter that is exactly a prompt ID is answered from the per-prompt
+        index. Any other filter is matched as a substring of either prompt ID,
+        scanning back from the newest battle only until enough are found.
+        
+        Args:
+            filter: Optional prompt ID or substring of one to filter by
+            limit: Maximum number of battles to return (default: 10)
+            
+        Returns:
+            List of up to limit Battle objects
+        """
+        if filter in self._by_prompt:
+            battles = reversed(self._by_prompt[filter])
+        elif filter:
+            battles = (
+                b for b in reversed(self._history)
+                if filter in b.red_prompt or filter in b.blue_prompt
+            )
+        else:
+            battles = reversed(self._history)
+        return list(itertools.islice(battles, limit))
+    
+    @staticmethod
+    def _parse_result(value: Optional[str]) -> Optional[dict]:
+        """Decode a stored battle result
+        
+        Results are stored as JSON. Rows written before that used Python's
+        repr, which is read with ast.literal_eval and rewritten as JSON the
+        next time the battles file is saved.
+        """
+        if not value:
+            return None
+        try:
+            return json.loads(value)
+        except json.JSONDecodeError:
+            return ast.literal_eval(value)
+    
     def get_battle_status(self, battle_id: str) -> Optional[Battle]:
         """Get the current status of a battle
         
@@ -1,43 +1,61 @@
-import csv
+from collections import defaultdict
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional, List, Dict
+from typing import Iterator, Optional, List, Dict, Set, Tuple
 from datetime import datetime
 from models.prompt import Prompt
+from . import storage
 import logging
 
 logger = logging.getLogger(__name__)
 
 class PromptManager:
+    COLUMNS = [
+        'user_id', 'type', 'code_name', 'content', 
+        'created_at', 'battles_won', 'battles_lost', 'rating'
+    ]
+    
     def __init__(self, csv_path: str = "data/prompts.csv"):
         """Initialize the PromptManager
         
         Args:
-            csv_path: Path to the CSV file for storing prompts (default: "data/prompts.csv")
+            csv_path: Path to the file for storing prompts (default: "data/prompts.csv").
+                A ".parquet" path stores prompts as Parquet instead of CSV
         """
         self.csv_path = Path(csv_path)
         self.prompts: Dict[str, Prompt] = {}
+        # Rating-sorted views per type filter (None = all prompts), rebuilt lazily after changes
+        self._rankings: Dict[Optional[str], List[Prompt]] = {}
+        # Bumped whenever a prompt is loaded, created, deleted or updated, so callers
+        # can tell when views derived from the prompts are stale
+        self.version = 0
+        # Per-user totals for player statistics, kept in step with every prompt write
+        self._user_stats: Dict[str, Dict[str, float]] = defaultdict(
+            lambda: {"wins": 0, "losses": 0, "rating_sum": 0.0, "prompts": 0}
+        )
+        # Contribution of each prompt currently counted in _user_stats
+        self._counted: Dict[str, Tuple[str, int, int, float]] = {}
+        # Secondary indexes: user ID / prompt type -> {prompt ID: Prompt}
+        self._by_user: Dict[str, Dict[str, Prompt]] = defaultdict(dict)
+        self._by_type: Dict[str, Dict[str, Prompt]] = defaultdict(dict)
+        # IDs of prompts updated since the last save, and whether updates save immediately
+        self._dirty: Set[str] = set()
+        self._autosave = True
         self.init_storage()
         self.load_prompts()
     
     def init_storage(self):
-        """Initialize storage directory and CSV file
+        """Initialize storage directory and data file
         
         Creates the data directory if it doesn't exist and initializes
-        the CSV file with appropriate headers.
+        the data file with appropriate headers.
         """
-        self.csv_path.parent.mkdir(parents=True, exist_ok=True)
-        if not self.csv_path.exists():
-            with open(self.csv_path, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                writer.writerow([
-                    'user_id', 'type', 'code_name', 'content', 
-                    'created_at', 'battles_won', 'battles_lost', 'rating'
-                ])
+        storage.init_table(self.csv_path, self.COLUMNS)
     
     def load_prompts(self):
-        """Load all prompts from CSV file
+        """Load all prompts from the data file
         
-        Reads the CSV file and creates Prompt objects for each row.
+        Reads the data file and creates Prompt objects for each row.
         Handles potential errors during loading and logs relevant information.
         
         Side effects:
@@ -48,61 +66,60 @@ class PromptManager:
             return
             
         try:
-            with open(self.csv_path, 'r', newline='', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    try:
-                        prompt = Prompt(
-                            user_id=row['user_id'],
-                            type=row['type'],
-                            code_name=row['code_name'],
-                            content=row['content'],
-                            created_at=datetime.fromisoformat(row['created_at']),
-                            battles_won=int(row['battles_won']),
-                            battles_lost=int(row['battles_lost']),
-                            rating=int(row['rating'])
-                        )
-                        self.prompts[prompt.id] = prompt
-                        logger.info(f"Loaded prompt: {prompt.id}")
-                    except Exception as e:
-                        logger.error(f"Failed to load prompt from row: {row}", exc_info=True)
-                        
-            logger.info(f"Loaded {len(self.prompts)} prompts")
-            logger.info(f"Available prompts: {list(self.prompts.keys())}")
+            for row in storage.read_rows(self.csv_path):
+                try:
+                    prompt = Prompt(
+                        user_id=row['user_id'],
+                        type=row['type'],
+                        code_name=row['code_name'],
+                        content=row['content'],
+                        created_at=storage.parse_datetime(row['created_at']),
+                        battles_won=int(row['battles_won']),
+                        battles_lost=int(row['battles_lost']),
+                        rating=float(row['rating'])
+                    )
+                    self.prompts[prompt.id] = prompt
+                    self._count_stats(prompt)
+                    self._index_prompt(prompt)
+                    logger.debug("Loaded prompt: %s", prompt.id)
+                except Exception as e:
+                    logger.error("Failed to load prompt from row: %s", row, exc_info=True)
+                    
+            self._invalidate_rankings()
+            logger.info("Loaded %d prompts", len(self.prompts))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Available prompts: %s", list(self.prompts.keys()))
         except Exception as e:
-            logger.error(f"Failed to load prompts from CSV: {str(e)}", exc_info=True)
+            logger.error("Failed to load prompts from %s: %s", self.csv_path, e, exc_info=True)
     
     def save_prompts(self):
-        """Save all prompts to CSV file
+        """Save all prompts to the data file
         
-        Writes the current state of all prompts to the CSV file.
+        Writes the current state of all prompts to the data file.
         Includes error handling and logging.
         
         Side effects:
-            - Updates the CSV file with current prompt data
+            - Updates the data file with current prompt data
             - Logs save status and any errors
         """
         try:
-            with open(self.csv_path, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                writer.writerow([
-                    'user_id', 'type', 'code_name', 'content', 
-                    'created_at', 'battles_won', 'battles_lost', 'rating'
-                ])
-                for prompt in self.prompts.values():
-                    writer.writerow([
-                        prompt.user_id,
-                        prompt.type,
-                        prompt.code_name,
-                        prompt.content,
-                        prompt.created_at.isoformat(),
-                        prompt.battles_won,
-                        prompt.battles_lost,
-                        prompt.rating
-                    ])
-            logger.info(f"Saved {len(self.prompts)} prompts to CSV")
+            storage.write_rows(self.csv_path, self.COLUMNS, [
+                [
+                    prompt.user_id,
+                    prompt.type,
+                    prompt.code_name,
+                    prompt.content,
+                    prompt.created_at,
+                    prompt.battles_won,
+                    prompt.battles_lost,
+                    prompt.rating
+                ]
+                for prompt in self.prompts.values()
+            ])
+            self._dirty.clear()
+            logger.debug("Saved %d prompts to %s", len(self.prompts), self.csv_path)
         except Exception as e:
-            logger.error(f"Failed to save prompts to CSV: {str(e)}", exc_info=True)
+            logger.error("Failed to save prompts to %s: %s", self.csv_path, e, exc_info=True)
     
     def create_prompt(self, user_id: str, type: str, code_name: str, content: str) -> Prompt:
         """Create a new prompt
@@ -120,6 +137,8 @@ class PromptManager:
             
         Side effects:
             - Adds prompt to self.prompts dictionary
+            - Invalidates cached rankings
+            - Updates the owner's aggregate statistics
             - Saves updated data to CSV
         """
         prompt = Prompt(
@@ -130,7 +149,10 @@ class PromptManager:
             created_at=datetime.now()
         )
         self.prompts[prompt.id] = prompt
-        logger.info(f"Created new prompt: {prompt.id}")
+        self._invalidate_rankings()
+        self._count_stats(prompt)
+        self._index_prompt(prompt)
+        logger.info("Created new prompt: %s", prompt.id)
         self.save_prompts()
         return prompt
     
@@ -145,19 +167,26 @@ class PromptManager:
             
         Side effects:
             - Removes prompt from self.prompts dictionary if found
+            - Invalidates cached rankings
+            - Updates the owner's aggregate statistics
             - Saves updated data to CSV if deletion successful
         """
         if prompt_id in self.prompts:
-            del self.prompts[prompt_id]
-            logger.info(f"Deleted prompt: {prompt_id}")
+            self._unindex_prompt(self.prompts.pop(prompt_id))
+            self._invalidate_rankings()
+            self._uncount_stats(prompt_id)
+            logger.info("Deleted prompt: %s", prompt_id)
             self.save_prompts()
             return True
-        logger.warning(f"Attempt to delete non-existent prompt: {prompt_id}")
+        logger.warning("Attempt to delete non-existent prompt: %s", prompt_id)
         return False
     
     def list_prompts(self, user_id: Optional[str] = None, type: Optional[str] = None) -> List[Prompt]:
         """List prompts with optional filtering
         
+        Filters are served from the per-user and per-type indexes, so the cost
+        scales with the number of matching prompts rather than all prompts.
+        
         Args:
             user_id: Optional filter by user ID
             type: Optional filter by prompt type ("attack" or "defense")
@@ -165,12 +194,37 @@ class PromptManager:
         Returns:
             List of Prompt objects matching the filters
         """
-        prompts = self.prompts.values()
+        if user_id and type:
+            # Scan whichever index is narrower and filter on the other field
+            by_user = self._by_user.get(user_id, {})
+            by_type = self._by_type.get(type, {})
+            if len(by_user) <= len(by_type):
+                return [p for p in by_user.values() if p.type == type]
+            return [p for p in by_type.values() if p.user_id == user_id]
         if user_id:
-            prompts = [p for p in prompts if p.user_id == user_id]
+            return list(self._by_user.get(user_id, {}).values())
         if type:
-            prompts = [p for p in prompts if p.type == type]
-        return list(prompts)
+            return list(self._by_type.get(type, {}).values())
+        return list(self.prompts.values())
+    
+    def top_k(self, k: int, type: Optional[str] = None) -> List[Prompt]:
+        """Get the highest rated prompts
+        
+        The rating-sorted view is cached per type and only rebuilt after a
+        prompt is created, deleted or updated, so repeated lookups cost O(k).
+        
+        Args:
+            k: Maximum number of prompts to return
+            type: Optional filter by prompt type ("attack" or "defense")
+            
+        Returns:
+            Up to k Prompt objects, highest rating first
+        """
+        ranking = self._rankings.get(type)
+        if ranking is None:
+            ranking = sorted(self.list_prompts(type=type), key=lambda p: p.rating, reverse=True)
+            self._rankings[type] = ranking
+        return ranking[:k]
     
     def update_prompt(self, prompt: Prompt):
         """Update an existing prompt
@@ -180,11 +234,95 @@ class PromptManager:
             
         Side effects:
             - Updates prompt in self.prompts dictionary
-            - Saves updated data to CSV
+            - Invalidates cached rankings
+            - Updates the owner's aggregate statistics
+            - Saves updated data, or defers the save until the end of a batch()
         """
         self.prompts[prompt.id] = prompt
-        logger.info(f"Updated prompt: {prompt.id}")
-        self.save_prompts()
+        self._invalidate_rankings()
+        self._count_stats(prompt)
+        self._index_prompt(prompt)
+        self._dirty.add(prompt.id)
+        logger.debug("Updated prompt: %s", prompt.id)
+        if self._autosave:
+            self.save_prompts()
+    
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """Group several prompt updates into a single save
+        
+        Inside the block, update_prompt only marks prompts as changed; the
+        data file is written once when the outermost batch exits.
+        
+        Example:
+            >>> with prompt_manager.batch():
+            ...     prompt_manager.update_prompt(red_prompt)
+            ...     prompt_manager.update_prompt(blue_prompt)
+        """
+        autosave, self._autosave = self._autosave, False
+        try:
+            yield
+        finally:
+            self._autosave = autosave
+            if autosave and self._dirty:
+                self.save_prompts()
+    
+    def user_stats(self, user_id: str) -> Optional[Dict[str, float]]:
+        """Get aggregate statistics for a user's prompts
+        
+        Totals are maintained incrementally as prompts are created, updated
+        and deleted, so this lookup does not scan the user's prompts.
+        
+        Args:
+            user_id: Discord user ID to look up
+            
+        Returns:
+            Dictionary with "prompts", "wins", "losses" and "rating_sum" totals,
+            or None if the user has no prompts
+        """
+        stats = self._user_stats.get(user_id)
+        return dict(stats) if stats else None
+    
+    def _invalidate_rankings(self):
+        """Drop the cached rankings and mark derived views as stale"""
+        self._rankings.clear()
+        self.version += 1
+    
+    def _count_stats(self, prompt: Prompt):
+        """Add a prompt's current record to its owner's totals, replacing any earlier count"""
+        self._uncount_stats(prompt.id)
+        stats = self._user_stats[prompt.user_id]
+        stats["prompts"] += 1
+        stats["wins"] += prompt.battles_won
+        stats["losses"] += prompt.battles_lost
+        stats["rating_sum"] += prompt.rating
+        self._counted[prompt.id] = (prompt.user_id, prompt.battles_won, prompt.battles_lost, prompt.rating)
+    
+    def _uncount_stats(self, prompt_id: str):
+        """Remove a prompt's previously counted record from its owner's totals"""
+        counted = self._counted.pop(prompt_id, None)
+        if not counted:
+            return
+        user_id, battles_won, battles_lost, rating = counted
+        stats = self._user_stats[user_id]
+        stats["prompts"] -= 1
+        stats["wins"] -= battles_won
+        stats["losses"] -= battles_lost
+        stats["rating_sum"] -= rating
+        if not stats["prompts"]:
+            del self._user_stats[user_id]
+    
+    def _index_prompt(self, prompt: Prompt):
+        """Add a prompt to the user and type indexes"""
+        self._by_user[prompt.user_id][prompt.id] = prompt
+        self._by_type[prompt.type][prompt.id] = prompt
+    
+    def _unindex_prompt(self, prompt: Prompt):
+        """Remove a prompt from the user and type indexes"""
+        for index, key in ((self._by_user, prompt.user_id), (self._by_type, prompt.type)):
+            index[key].pop(prompt.id, None)
+            if not index[key]:
+                del index[key]
     
     def get_prompt(self, prompt_id: str) -> Optional[Prompt]:
         """Get a specific prompt by ID
@@ -199,5 +337,5 @@ class PromptManager:
             - Logs warning if prompt not found
         """
         if prompt_id not in self.prompts:
-            logger.warning(f"Prompt not found: {prompt_id}")
+            logger.warning("Prompt not found: %s", prompt_id)
         return self.prompts.get(prompt_id)
\ No newline at end of file
@@ -0,0 +1,127 @@
+"""Table storage for the managers' data files
+
+Each data file is a table with a fixed set of columns. Paths ending in
+".parquet" are stored as Parquet through pyarrow, which keeps timestamps
+and numbers as typed columns and loads much faster than CSV; any other
+path is stored as CSV. pyarrow is only needed when Parquet is used.
+"""
+import csv
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Sequence
+import logging
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet storage is optional
+    pa = pq = None
+
+logger = logging.getLogger(__name__)
+
+def is_parquet(path: Path) -> bool:
+    """Check whether a data file is stored as Parquet
+
+    Args:
+        path: Path of the data file
+
+    Returns:
+        True for ".parquet" files, False for CSV
+
+    Raises:
+        ImportError: If the file is Parquet but pyarrow is not installed
+    """
+    if path.suffix != ".parquet":
+        return False
+    if pq is None:
+        raise ImportError(f"pyarrow is required to store data as Parquet: {path}")
+    return True
+
+def init_table(path: Path, columns: Sequence[str]):
+    """Create an empty data file with the given columns if it doesn't exist
+
+    A new Parquet file starts from the rows of the CSV file with the same name,
+    if there is one, so switching formats keeps existing data. Imported values
+    are stored as text until the owning manager next saves the file.
+
+    Args:
+        path: Path of the data file
+        columns: Column names
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists():
+        return
+    csv_path = path.with_suffix(".csv")
+    if is_parquet(path) and csv_path.exists():
+        rows = read_rows(csv_path)
+        write_rows(path, columns, [[row.get(column) for column in columns] for row in rows])
+        logger.info("Imported %d rows from %s into %s", len(rows), csv_path, path)
+        return
+    write_rows(path, columns, [])
+
+def read_rows(path: Path) -> List[Dict[str, Any]]:
+    """Read all rows of a data file
+
+    Args:
+        path: Path of the data file
+
+    Returns:
+        One dictionary per row, keyed by column name. CSV values are strings;
+        Parquet values keep their stored types (datetime, int, float, ...)
+    """
+    if is_parquet(path):
+        return pq.read_table(path).to_pylist()
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+def write_rows(path: Path, columns: Sequence[str], rows: List[Sequence[Any]]):
+    """Replace the contents of a data file
+
+    Args:
+        path: Path of the data file
+        columns: Column names
+        rows: Row values in column order. Datetimes are written in ISO format to CSV
+    """
+    if is_parquet(path):
+        if rows:
+            table = pa.Table.from_pylist([dict(zip(columns, row)) for row in rows])
+        else:
+            table = pa.table({column: pa.array([], pa.string()) for column in columns})
+        pq.write_table(table, path, compression='zstd')
+        return
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        writer.writerows(_csv_row(row) for row in rows)
+
+def append_row(path: Path, row: Sequence[Any]) -> bool:
+    """Append a single row to a data file, if its format supports it
+
+    Args:
+        path: Path of the data file
+        row: Row values in column order
+
+    Returns:
+        True if the row was appended, False if the format requires a full
+        rewrite with write_rows instead (Parquet)
+    """
+    if is_parquet(path):
+        return False
+    with open(path, 'a', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerow(_csv_row(row))
+    return True
+
+def parse_datetime(value: Any) -> datetime:
+    """Convert a stored timestamp back to a datetime
+
+    Args:
+        value: datetime from Parquet or ISO format string from CSV
+
+    Returns:
+        The timestamp as a datetime
+    """
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+def _csv_row(row: Sequence[Any]) -> List[Any]:
+    """Format row values for CSV output"""
+    return [value.isoformat() if isinstance(value, datetime) else value for value in row]
@@ -1,7 +1,7 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 
-@dataclass
+@dataclass(slots=True)
 class Prompt:
     """A class representing a prompt for prompt battles
     
@@ -13,7 +13,10 @@ class Prompt:
         created_at (datetime): Timestamp when prompt was created
         battles_won (int): Number of battles this prompt has won
         battles_lost (int): Number of battles this prompt has lost
-        rating (int): ELO rating for matchmaking, starts at 1500
+        rating (float): ELO rating for matchmaking, starts at 1500
+    
+    user_id, type and code_name make up the prompt's ID and must not change
+    after creation.
     """
     user_id: str
     type: str
@@ -22,16 +25,20 @@ class Prompt:
     created_at: datetime
     battles_won: int = 0
     battles_lost: int = 0
-    rating: int = 1500  # Initial ELO rating
+    rating: float = 1500.0  # Initial ELO rating
+    _id: str = field(init=False, repr=False, compare=False)
+    
+    def __post_init__(self):
+        self._id = f"@{self.user_id}/{self.type}/{self.code_name}"
     
     @property
     def id(self) -> str:
-        """Generate a unique identifier for the prompt
+        """Unique identifier for the prompt, built once at creation
         
         Returns:
             str: Unique ID in format "@user_id/type/code_name"
         """
-        return f"@{self.user_id}/{self.type}/{self.code_name}"
+        return self._id
     
     @property
     def win_rate(self) -> float: